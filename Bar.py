@@ -2,54 +2,127 @@ import FreeCAD
 import Part
 import Path
 import Mesh
+import numpy as np
 from PathScripts import PathToolController
 from Truss import BarGui
-from Truss import Mortise
+from Truss import Mortise, MortiseGui
 from Truss import PathAdaptive
 from Truss import PathJob, PathJobGui
 from Truss import PathStock
 
-class Bar():
-    def __init__(self, obj, mainBar, endBars, sideBars, width, height):
+# Properties of a bar object (type, name, group, tooltip, default), properties without
+# a default are left empty or set from the arguments passed to the constructor
+BAR_PROPERTIES = [
+    ("App::PropertyString", 'Description', 'Base', 'Bar description', "This is a bar"),
+    ("App::PropertyString", 'Type', 'Base', 'Object type', "Bar"),
 
-        obj.Proxy = self
-        self.obj = obj
-        doc = obj.Document
+    ("App::PropertyLength", 'Width', 'Dimensions', 'Box width', None),
+    ("App::PropertyLength", 'Height', 'Dimensions', 'Box height', None),
+
+    ("App::PropertyVector", "Test1", "Bars", "", None),
+    ("App::PropertyVectorList", "Test2", "Bars", "", None),
+    ("App::PropertyPythonObject", "Test3", "Bars", "", None),
+
+    ("Part::PropertyGeometryList", "OriginalMainBar", "Bars", "Line representing the main bar.", None),
+    ("Part::PropertyGeometryList", "OriginalEndBars", "Bars", "Lines representing the bars at the ends of the main bar.", None),
+    ("Part::PropertyGeometryList", "OriginalSideBars", "Bars", "Lines representing the bars on the sides of the main bar.", None),
+
+    ("Part::PropertyGeometryList", "MainBar", "Bars", "Line representing the main bar.", None),
+    ("Part::PropertyGeometryList", "EndBars", "Bars", "Lines representing the bars at the ends of the main bar.", None),
+    ("Part::PropertyGeometryList", "SideBars", "Bars", "Lines representing the bars on the sides of the main bar.", None),
+
+    ("Part::PropertyPartShape", "BarLines", "Bars", "All lines representing the main bar, end bars and side bars", None),
+]
+
+def unitVector(line):
+    """
+    Return the unit vector pointing from the start to the end of a line segment
+    """
+
+    return (line.EndPoint - line.StartPoint).normalize()
+
+def vectorsToArray(vectors):
+    """
+    Convert a list of vectors into an (N,3) array
+    """
+
+    return np.array([(v.x, v.y, v.z) for v in vectors], dtype=float).reshape(-1, 3)
+
+def barsToArray(bars):
+    """
+    Convert a list of line segments into an (N,2,3) array of start and end points
+    """
 
-        obj.addProperty("App::PropertyString", 'Description', 'Base', 'Bar description').Description = "This is a bar"
-        obj.addProperty("App::PropertyString", 'Type', 'Base', 'Object type').Type = "Bar"
+    return np.array([[(b.StartPoint.x, b.StartPoint.y, b.StartPoint.z), (b.EndPoint.x, b.EndPoint.y, b.EndPoint.z)] for b in bars], dtype=float).reshape(-1, 2, 3)
 
-        obj.addProperty("App::PropertyLength", 'Width', 'Dimensions', 'Box width').Width
-        obj.addProperty("App::PropertyLength", 'Height', 'Dimensions', 'Box height').Height
+def arrayToBars(points):
+    """
+    Convert an (N,2,3) array of start and end points into a list of line segments
+    """
 
-        obj.addProperty("App::PropertyVector", "Test1", "Bars", "")
-        obj.addProperty("App::PropertyVectorList", "Test2", "Bars", "")
-        obj.addProperty("App::PropertyPythonObject", "Test3", "Bars", "")
+    return [Part.LineSegment(FreeCAD.Vector(*start), FreeCAD.Vector(*end)) for start, end in points]
 
-        obj.addProperty("Part::PropertyGeometryList", "OriginalMainBar", "Bars", "Line representing the main bar.")
-        obj.addProperty("Part::PropertyGeometryList", "OriginalEndBars", "Bars", "Lines representing the bars at the ends of the main bar.")
-        obj.addProperty("Part::PropertyGeometryList", "OriginalSideBars", "Bars", "Lines representing the bars on the sides of the main bar.")
+def pointSegmentDistances(points, start, end):
+    """
+    Return the distance of each point in an (N,3) array to the segment between start and end
+    """
 
-        obj.addProperty("Part::PropertyGeometryList", "MainBar", "Bars", "Line representing the main bar.")
-        obj.addProperty("Part::PropertyGeometryList", "EndBars", "Bars", "Lines representing the bars at the ends of the main bar.")
-        obj.addProperty("Part::PropertyGeometryList", "SideBars", "Bars", "Lines representing the bars on the sides of the main bar.")
+    segment = end - start
+    t = np.clip((points - start) @ segment / segment.dot(segment), 0, 1)
+    closest = start + t[:, np.newaxis] * segment
+
+    return np.linalg.norm(points - closest, axis=1)
+
+def rayBoxExitPoints(starts, directions, boundBox):
+    """
+    Return the points where rays starting inside a bound box leave that box.
+    Starts and directions are (N,3) arrays, directions don't need to be normalized.
+    Like BoundBox.getIntersectionPoint, rays without length or starting outside the box raise a ValueError.
+    """
+
+    boxMin = np.array([boundBox.XMin, boundBox.YMin, boundBox.ZMin])
+    boxMax = np.array([boundBox.XMax, boundBox.YMax, boundBox.ZMax])
+
+    tolerance = 1e-7
+    invalid = np.all(directions == 0, axis=1) | np.any((starts < boxMin - tolerance) | (starts > boxMax + tolerance), axis=1)
+    if invalid.any():
+        raise ValueError("Bars %s have no length or don't start inside the stock" % np.flatnonzero(invalid).tolist())
+
+    # distance along each ray to the planes of the box, along axes the ray is
+    # parallel to it never leaves the box
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t0 = (boxMin - starts) / directions
+        t1 = (boxMax - starts) / directions
+    t = np.where(directions == 0, np.inf, np.maximum(t0, t1))
+    tExit = t.min(axis=1)
+
+    return starts + tExit[:, np.newaxis] * directions
+
+class Bar():
+
+    def __init__(self, obj, mainBar, endBars, sideBars, width, height):
+
+        obj.Proxy = self
+        self.obj = obj
+        doc = obj.Document
 
-        obj.addProperty("Part::PropertyPartShape", "BarLines", "Bars", "All lines representing the main bar, end bars and side bars")
+        for (propertyType, name, group, tooltip, default) in BAR_PROPERTIES:
+            obj.addProperty(propertyType, name, group, tooltip)
+            if default is not None:
+                setattr(obj, name, default)
 
         obj.Width = width
         obj.Height = height
         obj.OriginalMainBar = mainBar
         obj.OriginalEndBars = endBars
         obj.OriginalSideBars = sideBars
-        obj.MainBar = mainBar
-        obj.EndBars = endBars
-        obj.SideBars = sideBars
 
+        # sets MainBar, EndBars and SideBars
         self.orientBars(obj)
 
-        # STOCK SHAPE
-        
-        stockShape = self.getStockShape(obj)
+        # STOCK BOUND BOX
+
+        stockBoundBox = self.getStockBoundBox(obj)
 
         # PREPARE FEATURES
 
@@ -58,29 +131,34 @@ class Bar():
         ## END BARS
 
         mainBar = obj.MainBar[0]
-        endBar0 = obj.EndBars[0]
-        endBar1 = obj.EndBars[1]
+        endBar0, endBar1 = obj.EndBars[:2]
+
+        mainBarUnit = unitVector(mainBar)
 
         position = mainBar.StartPoint
-        normal = (mainBar.StartPoint - mainBar.EndPoint).normalize()
-        direction = (endBar0.EndPoint - endBar0.StartPoint).normalize()
+        normal = -mainBarUnit
+        direction = unitVector(endBar0)
         type = "tenon"
         features.append((position, normal, direction, type))
 
         position = mainBar.EndPoint
-        normal = (mainBar.EndPoint - mainBar.StartPoint).normalize()
-        direction = (endBar1.EndPoint - endBar1.StartPoint).normalize()
+        normal = mainBarUnit
+        direction = unitVector(endBar1)
         type = "tenon"
         features.append((position, normal, direction, type))
 
         ## SIDE BARS
 
-        mainBarEdge = Part.Edge(mainBar)
-        stockBoundBox = stockShape.BoundBox
-        for bar in obj.SideBars:
-            position = stockBoundBox.getIntersectionPoint(bar.StartPoint, (bar.EndPoint-bar.StartPoint).normalize())
-            normal = (bar.EndPoint - bar.StartPoint).normalize()
-            direction = (mainBar.EndPoint - mainBar.StartPoint).normalize()
+        sideBars = obj.SideBars
+        starts = vectorsToArray([bar.StartPoint for bar in sideBars])
+        ends = vectorsToArray([bar.EndPoint for bar in sideBars])
+        barVectors = ends - starts
+        positions = rayBoxExitPoints(starts, barVectors, stockBoundBox)
+        normals = barVectors / np.linalg.norm(barVectors, axis=1, keepdims=True)
+        direction = mainBarUnit
+        for position, normal in zip(positions, normals):
+            position = FreeCAD.Vector(*position)
+            normal = FreeCAD.Vector(*normal)
             type = "mortise"
             features.append((position, normal, direction, type))
 
@@ -98,20 +176,24 @@ class Bar():
             Mortise.Mortise(mortiseObject, mortiseResources)
             MortiseGui.ViewProviderBox(mortiseObject.ViewObject)
             mortiseObjects.append(mortiseObject)
+        Mortise.Mortise.placeBatch(mortiseObjects)
 
-        ## FUSION OF FEATURES 
+        ## CUT MORTISE FEATURES FROM BEAM
 
-        objectFusion = doc.addObject("Part::MultiFuse","Features")
-        objectFusion.Shapes = mortiseObjects
-        if objectFusion.ViewObject:
-            objectFusion.ViewObject.Visibility = False
+        # All features are cut from the beam in a single boolean operation with
+        # multiple tools, so OCCT intersects the beam with the features only once.
+        # Fusing the features first is far more expensive for OCCT.
 
-        ## CUT MORTISE FEATURES FROM BEAM
+        # only the mortise objects need a recompute to get their shapes, not the whole document
+        for mortiseObject in mortiseObjects:
+            mortiseObject.recompute()
 
-        doc.recompute()
+        # features that can't touch the stock don't need to take part in the boolean operation
+        toolShapes = [mortiseObject.Shape for mortiseObject in mortiseObjects if stockBoundBox.intersect(mortiseObject.Shape.BoundBox)]
 
-        featureShape = objectFusion.Shape
-        beamShape = stockShape.cut(featureShape)
+        beamShape = self.getStockShape(obj)
+        if toolShapes:
+            beamShape = beamShape.cut(toolShapes)
         obj.Shape = beamShape
 
         # ADAPTIVE OPERATIONS
@@ -136,24 +218,46 @@ class Bar():
             adaptiveObject.Stock = (mortiseObject, ['StockFace'])     # App::PropertyLinkSub
             adaptiveObjects.append(adaptiveObject)
 
-        # STOCK
+        # JOB
+
+        # Every bar has its own stock and job, only the tool controller and its tool
+        # are shared by the bars of a document
 
         stockObject = doc.addObject('Part::FeaturePython', 'Stock')
         PathStock.StockFromBase(stockObject, obj, {'x':2, 'y':2, 'z':2}, {'x':2, 'y':2, 'z':2})
 
-        # JOB
-
         jobObject = doc.addObject("Path::FeaturePython", "Job")
         PathJob.ObjectJob(jobObject)
         PathJobGui.ViewProvider(jobObject.ViewObject)
         jobObject.Proxy.addModels(jobObject, mortiseObjects)
         jobObject.Proxy.addStock(jobObject, stockObject)
+        jobObject.Proxy.addOperations(adaptiveObjects)
+
+        toolController = self.getToolController(doc)
+        jobObject.Proxy.addToolController(toolController)
         for adaptiveObject in adaptiveObjects:
-            jobObject.Proxy.addOperation(adaptiveObject)
+            adaptiveObject.ToolController = toolController
+
+    def getToolController(self, doc):
+        """
+        Return the tool controller shared by the bars in a document, it is created with its tool
+        for the first bar. The tool controller is found by its BarToolController property, so it
+        is also found after the document is reloaded.
+        """
+
+        for docObject in doc.Objects:
+            if getattr(docObject, 'BarToolController', False):
+                return docObject
 
         # TOOL CONTROLLER
 
-        toolController = PathToolController.Create()
+        # PathToolController.Create adds to the active document, which needn't be the document of the bar
+        toolController = doc.addObject("Path::FeaturePython", "ToolController")
+        PathToolController.ToolController(toolController)
+        if FreeCAD.GuiUp:
+            PathToolController.ViewProvider(toolController.ViewObject)
+        toolController.addProperty("App::PropertyBool", "BarToolController", "Base", "Tool controller shared by the bars of the document")
+        toolController.BarToolController = True
         toolController.Label = 'ToolController'
         toolController.ToolNumber = 1
         toolController.VertFeed = 1000
@@ -162,7 +266,6 @@ class Bar():
         toolController.HorizRapid = 3000
         toolController.SpindleDir = 'Forward'
         toolController.SpindleSpeed = 3500
-        jobObject.Proxy.addToolController(toolController)
 
         # TOOL
 
@@ -173,10 +276,9 @@ class Bar():
         tool.Diameter = 12
         tool.CuttingEdgeHeight = 100
         tool.LengthOffset = 100
-        jobObject.ToolController[0].Tool = tool
+        toolController.Tool = tool
 
-        for adaptiveObject in adaptiveObjects:
-            adaptiveObject.ToolController = jobObject.ToolController[0]
+        return toolController
 
     def orientBars(self, obj):
         """
@@ -205,22 +307,24 @@ class Bar():
         mainBar.transform(matrix)
         obj.MainBar = mainBar
 
-        bars = obj.OriginalEndBars
-        for i, bar in enumerate(bars):
-            bars[i].transform(matrix)
-        obj.EndBars = bars
+        # transform the end points of all other bars at once
+        transform = np.array(matrix.A).reshape(4, 4)
+        rotation = transform[:3, :3]
+        translation = transform[:3, 3]
+
+        points = barsToArray(obj.OriginalEndBars) @ rotation.T + translation
+        obj.EndBars = arrayToBars(points)
     
-        bars = obj.OriginalSideBars
-        mainBarEdge = Part.Edge(mainBar)
-        for i, bar in enumerate(bars):
-            bars[i].transform(matrix)
+        points = barsToArray(obj.OriginalSideBars) @ rotation.T + translation
 
-            # reverse bar if startPoint not on mainBar
-            startVertex = Part.Vertex(bar.StartPoint)
-            if mainBarEdge.distToShape(startVertex)[0] > 0.1:
-                bars[i].reverse()
+        # reverse bar if startPoint not on mainBar
+        mainBarStart = vectorsToArray([mainBar.StartPoint])[0]
+        mainBarEnd = vectorsToArray([mainBar.EndPoint])[0]
+        distances = pointSegmentDistances(points[:, 0], mainBarStart, mainBarEnd)
+        reverse = distances > 0.1
+        points[reverse] = points[reverse, ::-1]
 
-        obj.SideBars = bars
+        obj.SideBars = arrayToBars(points)
 
     def getStockShape(self, obj):
         """
@@ -236,6 +340,17 @@ class Bar():
         
         return stock
 
+    def getStockBoundBox(self, obj):
+        """
+        Get bound box of the stock shape for mainBar, without building the shape itself
+        """
+
+        length = obj.MainBar[0].length()
+        width = obj.Width.Value
+        height = obj.Height.Value
+
+        return FreeCAD.BoundBox(0, 0, 0, width, length, height)
+
     def execute(self, obj):
         """
         Called on document recompute
@@ -0,0 +1,35 @@
+import FreeCAD
+import os
+
+def getCacheDirectory(name):
+    """
+    Return the directory of one of the caches in the FreeCAD user directory.
+    Cached files are reused between documents and sessions.
+    """
+
+    return os.path.join(FreeCAD.getUserAppDataDir(), 'truss_cache', name)
+
+def touchCacheFile(path):
+    "Mark a cached file as recently used, so it is pruned last"
+
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+def pruneCache(directory, maxFiles):
+    "Remove the least recently used files of a cache directory until at most maxFiles are left"
+
+    try:
+        entries = [entry for entry in os.scandir(directory) if entry.is_file() and not entry.name.endswith('.tmp')]
+    except OSError:
+        return
+    if len(entries) <= maxFiles:
+        return
+
+    entries.sort(key=lambda entry: entry.stat().st_mtime)
+    for entry in entries[:len(entries) - maxFiles]:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
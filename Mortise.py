@@ -1,12 +1,195 @@
 import FreeCAD
 import Part
-import Path
-import PathScripts.PathToolController as PathToolController
+import functools
+import hashlib
+import json
+import numpy as np
+import os
+from Truss import Cache
 from Truss import MortiseGui
-from Truss import PathAdaptive
-from Truss import PathJob
-from Truss import PathJobGui
-from Truss import PathStock
+
+@functools.lru_cache(maxsize=64)
+def makeMortiseFace(length, width):
+    """
+    Return the face of a mortise with rounded ends, centered at the origin in the XY plane.
+    Faces are cached by their dimensions, callers should copy the result before modifying it.
+    """
+
+    ## Points in each quadrant
+    point0 = FreeCAD.Vector(+width/2, +length/2-width/2, 0)
+    point1 = FreeCAD.Vector(-width/2, +length/2-width/2, 0)
+    point2 = FreeCAD.Vector(-width/2, -length/2+width/2, 0)
+    point3 = FreeCAD.Vector(+width/2, -length/2+width/2, 0)
+
+    line03 = Part.LineSegment(point3,point0).toShape()
+    line21 = Part.LineSegment(point1,point2).toShape()
+    
+    ## Arcs
+    ### Midpoints
+    point10 = FreeCAD.Vector(0, +length/2, 0)
+    point32 = FreeCAD.Vector(0, -length/2, 0)
+    
+    arc01 = Part.Arc(point0,point10,point1).toShape()
+    arc23 = Part.Arc(point2,point32,point3).toShape()
+    
+    ## Face and Shape, edges ordered head to tail around the face
+    mortiseWire = Part.Wire([line03,arc01,line21,arc23])
+    mortiseFace = Part.Face(mortiseWire)
+
+    return mortiseFace
+
+@functools.lru_cache(maxsize=64)
+def makeStockFace(height, width):
+    """
+    Return the face of the stock, centered at the origin in the XY plane.
+    Faces are cached by their dimensions, callers should copy the result before modifying it.
+    """
+
+    centerPoint = FreeCAD.Vector(-height/2, -width/2, 0)
+    stockFace = Part.makePlane(height, width, centerPoint)
+
+    return stockFace
+
+# Version of the shapes in the shape cache, increase it when buildShape builds different shapes
+SHAPE_CACHE_VERSION = 2
+SHAPE_CACHE_SIZE = 256
+
+def getCachePath(shapeKey):
+    """
+    Return the path of the file in the shape cache for the given shape key.
+    Shapes are stored in the FreeCAD user directory, so they are reused between sessions.
+    """
+
+    name = hashlib.sha1(json.dumps([SHAPE_CACHE_VERSION, shapeKey]).encode()).hexdigest()
+    return os.path.join(Cache.getCacheDirectory('shapes'), name + '.brep')
+
+def readCachedShape(path):
+    "Return the shape stored at path, or None if it isn't in the cache"
+
+    if not os.path.exists(path):
+        return None
+    try:
+        shape = Part.Shape()
+        shape.importBrep(path)
+    except (OSError, Part.OCCError):
+        FreeCAD.Console.PrintWarning("Failed to read cached shape %s\n" % path)
+        return None
+    Cache.touchCacheFile(path)
+    return shape
+
+def writeCachedShape(shape, path):
+    "Store a shape in the cache, failing to do so only costs a rebuild later on"
+
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporaryPath = "%s.%d.tmp" % (path, os.getpid())
+        shape.exportBrep(temporaryPath)
+        os.replace(temporaryPath, path)
+    except (OSError, Part.OCCError):
+        FreeCAD.Console.PrintWarning("Failed to write cached shape %s\n" % path)
+    Cache.pruneCache(os.path.dirname(path), SHAPE_CACHE_SIZE)
+
+def vectorProperties(objs, name):
+    "Return the values of a vector property of a number of objects as an (N,3) array"
+
+    return np.array([(v.x, v.y, v.z) for v in (getattr(obj, name) for obj in objs)], dtype=float).reshape(-1, 3)
+
+def rotationQuaternions(fromVectors, toVectors):
+    """
+    Return the (N,4) quaternions (x, y, z, w) rotating each of the (N,3) fromVectors onto the toVectors.
+    Matches FreeCAD.Rotation(fromVector, toVector), including its choice of axis for opposite vectors.
+    """
+
+    u = fromVectors / np.linalg.norm(fromVectors, axis=1, keepdims=True)
+    v = toVectors / np.linalg.norm(toVectors, axis=1, keepdims=True)
+    dot = np.clip(np.einsum('ij,ij->i', u, v), -1, 1)
+    axis = np.cross(u, v)
+    axisLength = np.linalg.norm(axis, axis=1)
+
+    quaternions = np.zeros((len(u), 4))
+    quaternions[:, 3] = 1
+
+    # rotation around the axis perpendicular to both vectors
+    rotating = axisLength > 1e-12
+    halfAngle = np.arccos(dot[rotating]) / 2
+    quaternions[rotating, :3] = axis[rotating] / axisLength[rotating, np.newaxis] * np.sin(halfAngle)[:, np.newaxis]
+    quaternions[rotating, 3] = np.cos(halfAngle)
+
+    # opposite vectors, half a turn around any axis perpendicular to them
+    opposite = ~rotating & (dot < 0)
+    axis = np.cross(u[opposite], [1, 0, 0])
+    parallelToX = np.linalg.norm(axis, axis=1) < 1e-12
+    axis[parallelToX] = np.cross(u[opposite][parallelToX], [0, 1, 0])
+    quaternions[opposite, :3] = axis / np.linalg.norm(axis, axis=1, keepdims=True)
+    quaternions[opposite, 3] = 0
+
+    return quaternions
+
+def multiplyQuaternions(q1, q2):
+    "Return the (N,4) products q1*q2 of (N,4) quaternions (x, y, z, w), which rotate by q2 first"
+
+    x1, y1, z1, w1 = q1.T
+    x2, y2, z2, w2 = q2.T
+
+    return np.stack([
+        w1*x2 + x1*w2 + y1*z2 - z1*y2,
+        w1*y2 - x1*z2 + y1*w2 + z1*x2,
+        w1*z2 + x1*y2 - y1*x2 + z1*w2,
+        w1*w2 - x1*x2 - y1*y2 - z1*z2
+    ], axis=1)
+
+# Properties of a mortise object (type, name, group, tooltip, default), properties without
+# a default are left at their type default or set from the resources passed to the constructor
+MORTISE_PROPERTIES = [
+    ('App::PropertyString', 'Description', 'Base', 'Joint description', "Mortise and tenon joint"),
+    ('App::PropertyString', 'Type', 'Base', 'Joint type', None),
+
+    ('App::PropertyLength', 'StockWidth', 'Dimensions', 'Stock width', '102 mm'),
+    ('App::PropertyLength', 'StockHeight', 'Dimensions', 'Stock length', '102 mm'),
+    ('App::PropertyLength', 'MortiseWidth', 'Dimensions', 'Mortise width', '30 mm'),
+    ('App::PropertyLength', 'MortiseLength', 'Dimensions', 'Mortise length', '60 mm'),
+    ('App::PropertyLength', 'MortiseDepth', 'Dimensions', 'Mortise depth', '60 mm'),
+
+    ('Part::PropertyPartShape', 'StockFace', 'Faces', 'Face defining stock', None),
+    ('Part::PropertyPartShape', 'MortiseFace', 'Faces', 'Face defining feature', None),
+
+    ('App::PropertyVector', 'TemporaryPosition', 'Orientation', 'Temporary mortise position', None),
+    ('App::PropertyVector', 'TemporaryNormal', 'Orientation', 'Temporary mortise normal', FreeCAD.Vector(0,0,1)),
+    ('App::PropertyVector', 'TemporaryDirection', 'Orientation', 'Temporary mortise direction', FreeCAD.Vector(0,1,0)),
+
+    ('App::PropertyVector', 'Position', 'Orientation', 'Mortise position', None),
+    ('App::PropertyVector', 'Normal', 'Orientation', 'Mortise normal', None),
+    ('App::PropertyVector', 'Direction', 'Orientation', 'Mortise direction', None),
+]
+
+Y_AXIS = FreeCAD.Vector(0,1,0)
+Z_AXIS = FreeCAD.Vector(0,0,1)
+
+def axisKey(vector):
+    "Return a hashable key for a unit vector, rounded so axis vectors computed with float noise match"
+
+    return (round(vector.x, 9), round(vector.y, 9), round(vector.z, 9))
+
+def makeAxisRotations():
+    """
+    Return the rotations taking the default temporary orientation onto every axis aligned
+    normal and perpendicular direction, keyed by the axis keys of the normal and direction
+    """
+
+    axes = [FreeCAD.Vector(*v) for v in [(1,0,0), (-1,0,0), (0,1,0), (0,-1,0), (0,0,1), (0,0,-1)]]
+    rotations = {}
+    for normal in axes:
+        for direction in axes:
+            if normal.dot(direction) == 0:
+                rotation1 = FreeCAD.Rotation(Z_AXIS, normal)
+                rotation2 = FreeCAD.Rotation(Y_AXIS, direction)
+                rotations[(axisKey(normal), axisKey(direction))] = rotation1.multiply(rotation2)
+    return rotations
+
+AXIS_ROTATIONS = makeAxisRotations()
+
+# Properties the shape of a mortise is built from, any other change only affects its placement
+SHAPE_PROPERTIES = ['Type', 'MortiseLength', 'MortiseWidth', 'MortiseDepth', 'StockWidth', 'StockHeight', 'TemporaryNormal']
 
 class Mortise():
     """ Create a mortise and tenon joint"""
@@ -21,96 +204,192 @@ class Mortise():
             }
             
         obj.Proxy = self
-        self.obj = obj
-
-        obj.addProperty('App::PropertyString', 'Description', 'Base', 'Joint description').Description = "Mortise and tenon joint"
-        obj.addProperty('App::PropertyString', 'Type', 'Base', 'Joint type').Type = resources['type']
+        self.shapeDirty = True
 
-        obj.addProperty('App::PropertyLength', 'StockWidth', 'Dimensions', 'Stock width').StockWidth = '102 mm'
-        obj.addProperty('App::PropertyLength', 'StockHeight', 'Dimensions', 'Stock length').StockHeight = '102 mm'
-        obj.addProperty('App::PropertyLength', 'MortiseWidth', 'Dimensions', 'Mortise width').MortiseWidth = '30 mm'
-        obj.addProperty('App::PropertyLength', 'MortiseLength', 'Dimensions', 'Mortise length').MortiseLength = '60 mm'
-        obj.addProperty('App::PropertyLength', 'MortiseDepth', 'Dimensions', 'Mortise depth').MortiseDepth = '60 mm'
+        for (propertyType, name, group, tooltip, default) in MORTISE_PROPERTIES:
+            obj.addProperty(propertyType, name, group, tooltip)
+            if default is not None:
+                setattr(obj, name, default)
 
-        obj.addProperty('Part::PropertyPartShape', 'StockFace', 'Faces', 'Face defining stock')
-        obj.addProperty('Part::PropertyPartShape', 'MortiseFace', 'Faces', 'Face defining feature')
-
-        obj.addProperty('App::PropertyVector', 'TemporaryPosition', 'Orientation', 'Temporary mortise position').TemporaryPosition = FreeCAD.Vector(0,0,0)
-        obj.addProperty('App::PropertyVector', 'TemporaryNormal', 'Orientation', 'Temporary mortise normal').TemporaryNormal = FreeCAD.Vector(0,0,1)
-        obj.addProperty('App::PropertyVector', 'TemporaryDirection', 'Orientation', 'Temporary mortise direction').TemporaryDirection = FreeCAD.Vector(0,1,0)
-
-        obj.addProperty('App::PropertyVector', 'Position', 'Orientation', 'Mortise position').Position = resources['position']
-        obj.addProperty('App::PropertyVector', 'Normal', 'Orientation', 'Mortise normal').Normal = resources['normal']
-        obj.addProperty('App::PropertyVector', 'Direction', 'Orientation', 'Mortise direction').Direction = resources['direction']
+        obj.Type = resources['type']
+        obj.Position = resources['position']
+        obj.Normal = resources['normal']
+        obj.Direction = resources['direction']
 
     def getMortiseFace(self, obj):
         "Return temporary shape created at the origin and in a default orientation"
 
-        length = obj.MortiseLength.Value
-        width = obj.MortiseWidth.Value
-
-        ## Points in each quadrant
-        point0 = FreeCAD.Vector(+width/2, +length/2-width/2, 0)
-        point1 = FreeCAD.Vector(-width/2, +length/2-width/2, 0)
-        point2 = FreeCAD.Vector(-width/2, -length/2+width/2, 0)
-        point3 = FreeCAD.Vector(+width/2, -length/2+width/2, 0)
+        length = round(obj.MortiseLength.Value, 6)
+        width = round(obj.MortiseWidth.Value, 6)
 
-        line03 = Part.makeLine(point3,point0)
-        line21 = Part.makeLine(point1,point2)
-        
-        ## Arcs
-        ### Midpoints
-        point10 = FreeCAD.Vector(0, +length/2, 0)
-        point32 = FreeCAD.Vector(0, -length/2, 0)
-        
-        arc10 = Part.Edge(Part.Arc(point1,point10,point0))
-        arc32 = Part.Edge(Part.Arc(point3,point32,point2))
-        
-        ## Face and Shape
-        mortiseWire = Part.Wire([line03,arc32,line21,arc10])
-        mortiseFace = Part.Face(mortiseWire)
-
-        return mortiseFace
+        return makeMortiseFace(length, width).copy()
         
     def getStockFace(self, obj):
         "Return temporary shape created at the origin and in a default orientation"
 
-        height = obj.StockHeight.Value
-        width = obj.StockWidth.Value
-
-        centerPoint = FreeCAD.Vector(-height/2, -width/2, 0)
-        stockFace = Part.makePlane(height, width, centerPoint)
+        height = round(obj.StockHeight.Value, 6)
+        width = round(obj.StockWidth.Value, 6)
 
-        return stockFace
+        return makeStockFace(height, width).copy()
 
     def execute(self, obj):
         "Executed on document recomputes"
 
-        # Create mortise
+        # Create mortise, only when its dimensions changed since the last recompute
+
+        if getattr(self, 'shapeDirty', True):
+            self.buildShape(obj, self.getShapeKey(obj))
+            self.shapeDirty = False
+
+        # Set placement
+
+        self.applyPlacement(obj)
+
+    def onChanged(self, obj, prop):
+        "Invalidate the shape when one of the properties it is built from changes"
+
+        if prop in SHAPE_PROPERTIES:
+            self.shapeDirty = True
+
+    def __getstate__(self):
+        "Nothing of the proxy is saved, so restored mortises rebuild their shape on the first recompute"
+        return None
+
+    def __setstate__(self, state):
+        return None
+
+    def getShapeKey(self, obj):
+        "Return the values of all properties the shape is built from"
+
+        return (
+            obj.Type,
+            obj.MortiseLength.Value,
+            obj.MortiseWidth.Value,
+            obj.MortiseDepth.Value,
+            obj.StockWidth.Value,
+            obj.StockHeight.Value,
+            tuple(obj.TemporaryNormal)
+        )
+
+    def buildShape(self, obj, shapeKey):
+        "Build the shape at the origin and in a default orientation, or read it from the shape cache"
 
         obj.MortiseFace = self.getMortiseFace(obj)
         obj.StockFace = self.getStockFace(obj)
-        stockShape = obj.StockFace.extrude(-obj.MortiseDepth.Value * obj.TemporaryNormal)
-        mortiseShape = obj.MortiseFace.extrude(-obj.MortiseDepth.Value * obj.TemporaryNormal) 
-        cutoutShape = stockShape.cut(mortiseShape)
 
-        if obj.Type == "mortise":
-            obj.Shape = mortiseShape
-        else:
-            obj.Shape = cutoutShape
+        cachePath = getCachePath(shapeKey)
+        shape = readCachedShape(cachePath)
+        if shape:
+            obj.Shape = shape
+            return
 
-        # Set placement
+        depth = obj.MortiseDepth.Value
+        extrusion = -depth * obj.TemporaryNormal
 
-        obj.Placement.Base = obj.Position
-        rotation1 = FreeCAD.Rotation(obj.TemporaryNormal, obj.Normal)
-        rotation2 = FreeCAD.Rotation(obj.TemporaryDirection, obj.Direction)
-        obj.Placement.Rotation = rotation1.multiply(rotation2)
+        # the stock is only needed to cut out the tenon
+        if obj.Type == "mortise":
+            obj.Shape = obj.MortiseFace.extrude(extrusion)
+        elif obj.TemporaryNormal == Z_AXIS:
+            # in the default orientation the extruded stock face is a box below the XY plane
+            height = obj.StockHeight.Value
+            width = obj.StockWidth.Value
+            stockShape = Part.makeBox(height, width, depth, FreeCAD.Vector(-height/2, -width/2, -depth))
+            obj.Shape = stockShape.cut(obj.MortiseFace.extrude(extrusion))
+        else:
+            # extrude both faces in a single operation, the solids keep the order of the faces
+            faces = Part.Compound([obj.MortiseFace, obj.StockFace])
+            mortiseShape, stockShape = faces.extrude(extrusion).childShapes()
+            obj.Shape = stockShape.cut(mortiseShape)
+
+        writeCachedShape(obj.Shape, cachePath)
+
+    def applyPlacement(self, obj):
+        "Move the shape from the origin to its position and orientation"
+
+        # the rotation is only computed again when the vectors changed
+        vectors = self.getPlacementVectors(obj)
+        placementKey = self.getPlacementKey(obj)
+        if placementKey != getattr(self, 'placementKey', None) or getattr(self, 'placement', None) is None:
+            position, temporaryNormal, normal, temporaryDirection, direction = vectors
+            rotation = self.getRotation(temporaryNormal, normal, temporaryDirection, direction)
+            self.placement = FreeCAD.Placement(position, rotation)
+            self.placementKey = placementKey
+
+        # a placement edited by hand or restored from a file is reset as well
+        if obj.Placement != self.placement:
+            obj.Placement = self.placement
+
+    def getRotation(self, temporaryNormal, normal, temporaryDirection, direction):
+        """
+        Return the rotation taking the temporary normal and direction onto the normal and direction.
+        In the default temporary orientation, axis aligned orientations are looked up in AXIS_ROTATIONS.
+        Otherwise, with a horizontal direction perpendicular to a normal that doesn't point down, this is
+        the rotation that takes the axes onto (direction x normal, direction, normal), which FreeCAD
+        builds directly from those three vectors.
+        """
+
+        # vectors without length can't be normalized, FreeCAD handles them when building the rotation from them
+        if normal.Length < 1e-12 or direction.Length < 1e-12:
+            rotation1 = FreeCAD.Rotation(temporaryNormal, normal)
+            rotation2 = FreeCAD.Rotation(temporaryDirection, direction)
+            return rotation1.multiply(rotation2)
+
+        # normalize copies, normalize() changes the vectors of the caller
+        normal = FreeCAD.Vector(normal).normalize()
+        direction = FreeCAD.Vector(direction).normalize()
+
+        if temporaryNormal == Z_AXIS and temporaryDirection == Y_AXIS:
+            rotation = AXIS_ROTATIONS.get((axisKey(normal), axisKey(direction)))
+            if rotation is not None:
+                return FreeCAD.Rotation(rotation)
+
+        if (temporaryNormal == Z_AXIS and temporaryDirection == Y_AXIS
+                and abs(direction.z) < 1e-9 and abs(direction.dot(normal)) < 1e-9 and normal.z > -1 + 1e-6):
+            return FreeCAD.Rotation(direction.cross(normal), direction, normal, 'ZYX')
+
+        rotation1 = FreeCAD.Rotation(temporaryNormal, normal)
+        rotation2 = FreeCAD.Rotation(temporaryDirection, direction)
+        return rotation1.multiply(rotation2)
+
+    def getPlacementVectors(self, obj):
+        "Return the properties the placement is derived from, each read once"
+
+        return (obj.Position, obj.TemporaryNormal, obj.Normal, obj.TemporaryDirection, obj.Direction)
+
+    def getPlacementKey(self, obj):
+        "Return the values of all properties the placement is derived from"
+
+        return tuple(tuple(v) for v in self.getPlacementVectors(obj))
+
+    @classmethod
+    def placeBatch(cls, objs):
+        """
+        Set the placement of a number of mortise objects at once, computing all rotations in a single pass.
+        Objects placed this way don't compute their rotation again on their next recompute.
+        """
+
+        rotations1 = rotationQuaternions(vectorProperties(objs, 'TemporaryNormal'), vectorProperties(objs, 'Normal'))
+        rotations2 = rotationQuaternions(vectorProperties(objs, 'TemporaryDirection'), vectorProperties(objs, 'Direction'))
+        rotations = multiplyQuaternions(rotations1, rotations2)
+
+        for obj, rotation in zip(objs, rotations):
+            obj.Proxy.placement = FreeCAD.Placement(obj.Position, FreeCAD.Rotation(*rotation))
+            obj.Proxy.placementKey = obj.Proxy.getPlacementKey(obj)
+            obj.Placement = obj.Proxy.placement
 
 def test():
     ''' 
     Create a few Mortise objects and add them to a document, for testing
     ''' 
 
+    # The Path workbench is only needed to machine the test joints, not to build mortise shapes
+    import Path
+    import PathScripts.PathToolController as PathToolController
+    from Truss import PathAdaptive
+    from Truss import PathJob
+    from Truss import PathJobGui
+    from Truss import PathStock
+
     document = FreeCAD.newDocument()
 
     # BEAM
@@ -160,15 +439,19 @@ def test():
         MortiseGui.ViewProviderBox(mortiseObject.ViewObject)
         mortiseObjects.append(mortiseObject)
     
-    # Fusion of features
-    objectFusion = document.addObject("Part::MultiFuse","Features")
-    objectFusion.Shapes = mortiseObjects
+    # Properties the adaptive operations are set up from, read once
+    snapshots = [(m.Type, m.MortiseDepth.Value, FreeCAD.Vector(m.Position), FreeCAD.Vector(m.Normal), FreeCAD.Vector(m.Direction))
+                 for m in mortiseObjects]
 
     # CUT MORTISE FEATURES FROM BEAM
 
-    document.recompute()
+    Mortise.placeBatch(mortiseObjects)
+    for mortiseObject in mortiseObjects:
+        mortiseObject.recompute()
 
-    featureShape = objectFusion.Shape
+    # Fusion of features
+    shapes = [mortiseObject.Shape for mortiseObject in mortiseObjects]
+    featureShape = shapes[0].multiFuse(shapes[1:])
     beamShape = beamShape.cut(featureShape)
     beamObject = document.addObject("Part::Feature", "Beam")
     beamObject.Shape = beamShape
@@ -176,19 +459,19 @@ def test():
     # ADAPTIVE OPERATIONS
 
     adaptiveObjects = []
-    for mortiseObject in mortiseObjects:
+    for mortiseObject, (type, depth, position, normal, direction) in zip(mortiseObjects, snapshots):
         adaptiveResources = {
-            'side': 'Inside' if mortiseObject.Type == 'mortise' else 'Outside',
+            'side': 'Inside' if type == 'mortise' else 'Outside',
             'liftDistance': 1,
             'clearanceHeight': 20,
             'safeHeight': 10,
             'startDepth': 0,
             'stepDown': 10,
             'finishStep': 0,
-            'finalDepth': -mortiseObject.MortiseDepth.Value,
-            'position': mortiseObject.Position,
-            'normal': mortiseObject.Normal,
-            'direction': mortiseObject.Direction
+            'finalDepth': -depth,
+            'position': position,
+            'normal': normal,
+            'direction': direction
         }
         adaptiveObject = PathAdaptive.create(document, adaptiveResources)
         adaptiveObject.Base = (mortiseObject, ['MortiseFace'])    	# App::PropertyLinkSub
@@ -207,8 +490,7 @@ def test():
     PathJobGui.ViewProvider(jobObject.ViewObject)
     jobObject.Proxy.addModels(jobObject, mortiseObjects)
     jobObject.Proxy.addStock(jobObject, stockObject)
-    for adaptiveObject in adaptiveObjects:
-        jobObject.Proxy.addOperation(adaptiveObject)
+    jobObject.Proxy.addOperations(adaptiveObjects)
 
     # TOOL CONTROLLER
 
@@ -25,10 +25,15 @@ import Path
 import FreeCAD
 from FreeCAD import Console
 import time
-import json
+import hashlib
 import math
+import numpy as np
+import os
+import tempfile
+import zipfile
 import area
 from PathScripts import PathToolController
+from Truss import Cache
 from Truss import PathAdaptiveGui
 from Truss import PathOpGui
 from Truss import PathJob
@@ -40,13 +45,226 @@ def shapeToPath2d(shape, deflection=0.0001):
     The resulting path consists in a list of edges, with each edge being a list of points, and each point being an [x,y] coordinate.
     """
     points3d = shape.OuterWire.discretize(Deflection=deflection)
-    points2d = list()
-    for point in points3d:
-        points2d.append([point[0], point[1]])
+    points2d = np.array(points3d, dtype=np.float64).reshape(-1, 3)[:, :2].tolist()
     path2d = [points2d]
 
     return path2d
 
+# Version of the cached adaptive results, increase it when packResults or the use of the libarea results changes
+RESULTS_CACHE_VERSION = 1
+RESULTS_CACHE_SIZE = 256
+
+def inputStateHash(inputStateObject):
+    """
+    Return a hash of the input state of an adaptive operation.
+    Geometry is hashed from its raw coordinates, so it doesn't have to be serialized to compare states.
+    The hash includes the results version and the FreeCAD version that libarea comes with, so results of other versions aren't reused.
+    """
+
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(b'%d' % RESULTS_CACHE_VERSION)
+    digest.update(repr(FreeCAD.Version()).encode())
+    for key in sorted(inputStateObject):
+        value = inputStateObject[key]
+        digest.update(key.encode())
+        if key in ('geometry', 'stockGeometry'):
+            for path in value:
+                digest.update(b'%d' % len(path))
+                digest.update(np.array(path, dtype=np.float64).tobytes())
+        else:
+            digest.update(repr(value).encode())
+
+    return digest.hexdigest()
+
+def getCachePath(inputHash):
+    """
+    Return the path of the file in the adaptive results cache for the given input state hash.
+    Results are stored in the FreeCAD user directory, so they are reused between documents and sessions.
+    """
+
+    return os.path.join(Cache.getCacheDirectory('adaptive'), inputHash + '.npz')
+
+def packResults(adaptiveResults):
+    "Return the adaptive results as flat arrays, with the number of paths per region and points per path"
+
+    paths = [path for region in adaptiveResults for path in region["AdaptivePaths"]]
+    return {
+        'centers': np.array([region["HelixCenterPoint"] for region in adaptiveResults], dtype=np.float64).reshape(-1, 2),
+        'starts': np.array([region["StartPoint"] for region in adaptiveResults], dtype=np.float64).reshape(-1, 2),
+        'returnTypes': np.array([int(region["ReturnMotionType"]) for region in adaptiveResults], dtype=np.int64),
+        'pathCounts': np.array([len(region["AdaptivePaths"]) for region in adaptiveResults], dtype=np.int64),
+        'pathTypes': np.array([int(path[0]) for path in paths], dtype=np.int64),
+        'pointCounts': np.array([len(path[1]) for path in paths], dtype=np.int64),
+        'points': np.array([point for path in paths for point in path[1]], dtype=np.float64).reshape(-1, 2)
+    }
+
+def unpackResults(arrays):
+    "Return the adaptive results packed by packResults"
+
+    pointsPerPath = np.split(arrays['points'], np.cumsum(arrays['pointCounts'])[:-1])
+    paths = [(pathType, points.tolist()) for pathType, points in zip(arrays['pathTypes'].tolist(), pointsPerPath)]
+
+    adaptiveResults = []
+    firstPath = 0
+    for center, start, returnType, pathCount in zip(arrays['centers'].tolist(), arrays['starts'].tolist(),
+            arrays['returnTypes'].tolist(), arrays['pathCounts'].tolist()):
+        adaptiveResults.append({
+            "HelixCenterPoint": center,
+            "StartPoint": start,
+            "AdaptivePaths": paths[firstPath:firstPath+pathCount],
+            "ReturnMotionType": returnType })
+        firstPath += pathCount
+
+    return adaptiveResults
+
+def readResultsFile(path):
+    "Return the adaptive results stored at path, or None if there is no such file"
+
+    if not os.path.exists(path):
+        return None
+    try:
+        with np.load(path) as arrays:
+            return unpackResults(arrays)
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+        Console.PrintWarning("Failed to read adaptive results %s\n" % path)
+        return None
+
+def writeResultsFile(adaptiveResults, path):
+    "Store adaptive results in a file and return whether that worked, failing only costs a recalculation later on"
+
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporaryPath = "%s.%d.tmp" % (path, os.getpid())
+        with open(temporaryPath, 'wb') as f:
+            np.savez_compressed(f, **packResults(adaptiveResults))
+        os.replace(temporaryPath, path)
+    except OSError:
+        Console.PrintWarning("Failed to write adaptive results %s\n" % path)
+        return False
+    return True
+
+def vectorRotation(fromVector, toVector):
+    """
+    Return the rotation from one vector to another, which is the identity rotation when they are equal
+    """
+
+    if fromVector.isEqual(toVector, 1e-9):
+        return FreeCAD.Rotation()
+    return FreeCAD.Rotation(fromVector, toVector)
+
+def regionHelix(region, tanHelix, maxPassDepth):
+    """
+    Return the helix entry of an adaptive region as (radius, start point, depth per revolution, angles, xs, ys),
+    with the points of a helix deep enough for the deepest pass plus one circle, or None for a straight entry
+    """
+
+    center = region["HelixCenterPoint"]
+    start = region["StartPoint"]
+    dx = center[0] - start[0]
+    dy = center[1] - start[1]
+    helixRadius = math.hypot(dx, dy)
+    if helixRadius <= 0.0001:
+        return None
+
+    startAngle = math.atan2(-dy, -dx)
+    helixStart = [center[0] + helixRadius * math.cos(startAngle), center[1] + helixRadius * math.sin(startAngle)]
+
+    # calculate depth per helix revolution
+    circumference = 2*math.pi * helixRadius
+    depthPerRevolution = circumference * tanHelix
+    maxRadians = maxPassDepth / depthPerRevolution * 2 * math.pi
+
+    angles = np.arange(0, maxRadians + 2*math.pi, math.pi/18)
+    # cos and sin of each angle from a single complex exponential
+    points = complex(center[0], center[1]) + helixRadius * np.exp(1j * (angles + startAngle))
+
+    return helixRadius, helixStart, depthPerRevolution, angles, points.real.tolist(), points.imag.tolist()
+
+def flattenPaths(region):
+    """
+    Return the points of the adaptive paths of a region as an array of motion types and an (N,2) array of points.
+    Only points with a motion type that is machined are kept.
+    """
+
+    machinedTypes = [int(area.AdaptiveMotionType.Cutting), int(area.AdaptiveMotionType.LinkClear), int(area.AdaptiveMotionType.LinkNotClear)]
+    paths = region["AdaptivePaths"]
+    motionTypes = np.repeat(np.array([int(path[0]) for path in paths], dtype=np.int8), [len(path[1]) for path in paths])
+    points = np.array([point for path in paths for point in path[1]], dtype=np.float64).reshape(-1, 2)
+    machined = np.isin(motionTypes, machinedTypes)
+
+    return motionTypes[machined], points[machined]
+
+def regionGCode(region, helix, regionPoints, passStartDepth, passEndDepth, stepUp, clearanceHeight, safeHeight, vertFeed, horizFeed):
+    """
+    Return the G-code lines machining an adaptive region in one pass, starting with its helix or straight
+    entry and ending at clearance height. Regions and passes don't depend on each other's moves.
+    The helix and points of the region are computed once for all passes by regionHelix and flattenPaths.
+    """
+
+    gcodeLines = []
+    start = region["StartPoint"]
+    
+    #helix ramp
+    if helix:
+        helixRadius, helixStart, depthPerRevolution, angles, xs, ys = helix
+        Console.PrintMessage("Helix radius = %f\n"%helixRadius)
+        gcodeLines.append("(Helix to pass depth: %f)"%passEndDepth)
+
+        gcodeLines.append("G0 X%f Y%f Z%f" % (helixStart[0], helixStart[1], clearanceHeight))
+        gcodeLines.append("G0 X%f Y%f Z%f" % (helixStart[0], helixStart[1], safeHeight))
+        gcodeLines.append("G1 X%f Y%f Z%f F%f" % (helixStart[0], helixStart[1], passStartDepth, vertFeed))
+    
+        passDepth = (passStartDepth - passEndDepth)
+        maxRadians =  passDepth / depthPerRevolution *  2 * math.pi
+
+        # ramp down to the pass depth, then one more circle at target depth to make sure center is cleared
+        count = int(np.searchsorted(angles, maxRadians + 2*math.pi))
+        passAngles = angles[:count]
+        ramp = passAngles < maxRadians
+        zs = np.where(ramp, passStartDepth - passAngles * depthPerRevolution / (2*math.pi), passEndDepth)
+        feeds = np.where(ramp, vertFeed, horizFeed)
+        gcodeLines.extend(["G1 X%f Y%f Z%f F%f" % point for point in zip(xs[:count], ys[:count], zs.tolist(), feeds.tolist())])
+        entryPoint = [xs[count-1], ys[count-1]]
+
+    else: # no helix entry
+        gcodeLines.append("(Straight to pass depth: %f)"%passEndDepth)
+        gcodeLines.append("G0 X%f Y%f Z%f" % (start[0], start[1], clearanceHeight))
+        gcodeLines.append("G1 X%f Y%f Z%f F%f" % (start[0], start[1], passEndDepth, vertFeed))
+        entryPoint = [start[0], start[1]]
+    
+    # heights and motion types of the cutting and linking moves in this pass
+    cuttingZ = passEndDepth
+    linkClearZ = passEndDepth + stepUp
+    linkNotClearZ = clearanceHeight
+    cutting = int(area.AdaptiveMotionType.Cutting)
+    linkClear = int(area.AdaptiveMotionType.LinkClear)
+    motionTypes, points = regionPoints
+
+    # height of each point, and whether the tool has to move to it before moving in XY, from the previous point
+    zs = np.select([motionTypes == cutting, motionTypes == linkClear], [cuttingZ, linkClearZ], linkNotClearZ)
+    zChanges = zs != np.concatenate(([passEndDepth], zs[:-1]))
+    previousPoints = np.concatenate(([entryPoint], points[:-1])) if len(points) else points
+    xyChanges = np.any(points != previousPoints, axis=1)
+
+    # every move gets all three coordinates, so the toolpath can be placed without tracking the tool position
+    gcodeLines.append("(Adaptive toolpath at depth: %f)"%passEndDepth)
+    # moves to the XY the tool is already at are left out
+    for motionType, (x, y), z, zChange, xyChange, (previousX, previousY) in zip(motionTypes.tolist(), points.tolist(),
+            zs.tolist(), zChanges.tolist(), xyChanges.tolist(), previousPoints.tolist()):
+        if motionType == cutting:
+            if zChange: gcodeLines.append("G1 X%f Y%f Z%f F%f" % (previousX, previousY, z, vertFeed))
+            if xyChange: gcodeLines.append("G1 X%f Y%f Z%f F%f" % (x, y, z, horizFeed))
+        else:
+            if zChange: gcodeLines.append("G0 X%f Y%f Z%f" % (previousX, previousY, z))
+            if xyChange: gcodeLines.append("G0 X%f Y%f Z%f" % (x, y, z))
+    lastX, lastY = points[-1].tolist() if len(points) else entryPoint
+    lastZ = zs[-1] if len(zs) else passEndDepth
+    #return to safe height, which also leaves the tool there after each pass and the last one
+    z=clearanceHeight
+    if z!=lastZ: gcodeLines.append("G0 X%f Y%f Z%f" % (lastX, lastY, z))
+
+    return gcodeLines
+
 class PathAdaptive():
     """
     Create an adaptive milling operation
@@ -83,8 +301,10 @@ class PathAdaptive():
         obj.ForceInsideOut = False
 
         # Properties for inspecting input to and output from the libarea method
-        obj.addProperty("App::PropertyPythonObject", "AdaptiveInputState","Adaptive", "Internal input state").AdaptiveInputState = ""
+        obj.addProperty("App::PropertyPythonObject", "AdaptiveInputState","Adaptive", "Internal input state of earlier versions").AdaptiveInputState = ""
         obj.addProperty("App::PropertyPythonObject", "AdaptiveOutputState","Adaptive", "Internal output state").AdaptiveOutputState = ""
+        obj.addProperty("App::PropertyFileIncluded", "AdaptiveOutputFile", "Adaptive", "Internal output state, stored as arrays")
+        obj.addProperty("App::PropertyString", "AdaptiveInputHash", "Adaptive", "Hash of the internal input state").AdaptiveInputHash = ""
 
         # These properties should be placed in a toolcontroller
         obj.addProperty("App::PropertyLink", "ToolController", "Path", "The tool controller that will be used to calculate the path")
@@ -112,6 +332,14 @@ class PathAdaptive():
         obj.addProperty('App::PropertyVector', 'Normal', 'Orientation', 'Mortise normal').Normal = resources['normal']
         obj.addProperty('App::PropertyVector', 'Direction', 'Orientation', 'Mortise direction').Direction = resources['direction']
 
+    def onDocumentRestored(self, obj):
+        "Add properties missing from operations saved by earlier versions"
+
+        if not hasattr(obj, 'AdaptiveInputHash'):
+            obj.addProperty("App::PropertyString", "AdaptiveInputHash", "Adaptive", "Hash of the internal input state").AdaptiveInputHash = ""
+        if not hasattr(obj, 'AdaptiveOutputFile'):
+            obj.addProperty("App::PropertyFileIncluded", "AdaptiveOutputFile", "Adaptive", "Internal output state, stored as arrays")
+
     def progressFn(self, tpaths):
         """ Progress callback function, will stop processing of area.Adaptive2d operation when returning True """
 
@@ -129,10 +357,12 @@ class PathAdaptive():
         # Fetch faces
         baseFace = getattr(obj.Base[0], obj.Base[1][0])
         stockFace = getattr(obj.Stock[0], obj.Stock[1][0])
-        basePath2d = shapeToPath2d(baseFace)
-        stockPath2d = shapeToPath2d(stockFace)
         # Set lower limit on tolerance
-        if obj.Tolerance<0.001: obj.Tolerance=0.001
+        tolerance = max(float(obj.Tolerance), 0.001)
+        # Discretize the faces an order of magnitude finer than the adaptive tolerance, finer points are wasted
+        deflection = tolerance/10
+        basePath2d = shapeToPath2d(baseFace, deflection)
+        stockPath2d = shapeToPath2d(stockFace, deflection)
         # Set operation type
         operationTypeString = obj.OperationType + obj.Side
         operationType = getattr(area.AdaptiveOperationType, operationTypeString)
@@ -140,7 +370,7 @@ class PathAdaptive():
         # Put all properties that influence calculation of adaptive base paths here
         inputStateObject = {
             "tool": float(obj.ToolDiameter),
-            "tolerance": float(obj.Tolerance),
+            "tolerance": tolerance,
             "geometry" : basePath2d,
             "stockGeometry": stockPath2d,
             "stepover" : float(obj.StepOver),
@@ -152,18 +382,32 @@ class PathAdaptive():
             "stockToLeave": float(obj.StockToLeave)
         }
     
-        # Check if something changed that requires 2D path recalculation 
-        if json.dumps(obj.AdaptiveInputState) != json.dumps(inputStateObject):
-             adaptiveResults = None
-
-        # Check if there is a previous output state
-        if obj.AdaptiveOutputState !=None and obj.AdaptiveOutputState != "":
-             adaptiveResults = obj.AdaptiveOutputState
-        else:
-             adaptiveResults = None
+        # Check if something changed that requires 2D path recalculation, documents saved by
+        # earlier versions have no input hash and keep their output state in AdaptiveOutputState
+        inputHash = inputStateHash(inputStateObject)
+        storedHash = obj.AdaptiveInputHash
+        if not storedHash and obj.AdaptiveInputState:
+             storedHash = inputStateHash(obj.AdaptiveInputState)
+
+        # Reuse the previous output state if nothing changed
+        adaptiveResults = None
+        resultsInDocument = False
+        if storedHash == inputHash:
+             if obj.AdaptiveOutputFile:
+                  adaptiveResults = readResultsFile(obj.AdaptiveOutputFile)
+                  resultsInDocument = adaptiveResults != None
+             if adaptiveResults == None and obj.AdaptiveOutputState !=None and obj.AdaptiveOutputState != "":
+                  adaptiveResults = obj.AdaptiveOutputState
    
         start=time.time()
 
+        # Identical inputs may have been calculated before, by another operation or document
+        cachePath = getCachePath(inputHash)
+        if adaptiveResults == None:
+            adaptiveResults = readResultsFile(cachePath)
+            if adaptiveResults != None:
+                Cache.touchCacheFile(cachePath)
+
         if adaptiveResults == None:
             a2d = area.Adaptive2d()
             a2d.stepOverFactor = 0.01*obj.StepOver
@@ -171,7 +415,7 @@ class PathAdaptive():
             a2d.helixRampDiameter =  obj.HelixDiameterLimit.Value
             a2d.keepToolDownDistRatio = obj.KeepToolDownRatio.Value
             a2d.stockToLeave =float(obj.StockToLeave)
-            a2d.tolerance = float(obj.Tolerance)
+            a2d.tolerance = tolerance
             a2d.forceInsideOut = obj.ForceInsideOut
             a2d.opType = operationType
             #EXECUTE
@@ -185,13 +429,34 @@ class PathAdaptive():
                     "StartPoint": result.StartPoint,
                     "AdaptivePaths": result.AdaptivePaths,
                     "ReturnMotionType": result.ReturnMotionType })
+            writeResultsFile(adaptiveResults, cachePath)
+            Cache.pruneCache(os.path.dirname(cachePath), RESULTS_CACHE_SIZE)
     
-        obj.AdaptiveInputState = inputStateObject
-        obj.AdaptiveOutputState = adaptiveResults
+        # Only the hash of the input state is kept, the state itself holds the whole geometry
+        obj.AdaptiveInputState = ""
+        obj.AdaptiveInputHash = inputHash
+
+        # Include the results in the document as a compressed array file, as a Python object they are slow to save and load
+        # The results are written to a temporary file of their own, which the property copies in, so neither the
+        # file the property holds nor the results cache are overwritten
+        if not resultsInDocument:
+            outputHandle, outputPath = tempfile.mkstemp(suffix='.npz')
+            os.close(outputHandle)
+            try:
+                if writeResultsFile(adaptiveResults, outputPath):
+                    obj.AdaptiveOutputFile = outputPath
+                    obj.AdaptiveOutputState = ""
+                else:
+                    # the included file holds results of other inputs, it mustn't be read with the new input hash
+                    obj.AdaptiveOutputFile = ""
+                    obj.AdaptiveOutputState = adaptiveResults
+            finally:
+                if os.path.exists(outputPath):
+                    os.remove(outputPath)
 
         self.generateGCode(obj, adaptiveResults)
 
-        obj.TemporaryPath = Path.Path(self.commandList)
+        obj.TemporaryPath = Path.Path("\n".join(self.gcodeLines))
         obj.Path = obj.TemporaryPath
 
         self.placeToolpath(obj)
@@ -200,14 +465,15 @@ class PathAdaptive():
 
     def generateGCode(self, obj, adaptiveResults):
 
-        if len(adaptiveResults)==0 or len(adaptiveResults[0]["AdaptivePaths"])==0: return
+        # G-code is collected as text and parsed into a Path once, which is much faster than creating a Path.Command per move
+        self.gcodeLines = []
 
-        self.commandList = []
+        if len(adaptiveResults)==0 or len(adaptiveResults[0]["AdaptivePaths"])==0: return
 
-        self.commandList.append(Path.Command("(Start of adaptive operation)"))
+        self.gcodeLines.append("(Start of adaptive operation)")
 
         operationStartPoint = obj.TemporaryPosition + obj.ClearanceHeight.Value*obj.TemporaryNormal.normalize()
-        self.commandList.append(Path.Command("G0", {"X": operationStartPoint.x, "Y": operationStartPoint.y, "Z": operationStartPoint.z}))
+        self.gcodeLines.append("G0 X%f Y%f Z%f" % (operationStartPoint.x, operationStartPoint.y, operationStartPoint.z))
     
         stepDown = obj.StepDown.Value
         if stepDown<0.1 : stepDown = 0.1
@@ -217,100 +483,35 @@ class PathAdaptive():
         finish_step = obj.FinishStep.Value
 
         if finish_step>stepDown: finish_step = stepDown
-        if float(obj.HelixAngle)<1: obj.HelixAngle=1
+
+        # Property values used for every region and pass
+        clearanceHeight = obj.ClearanceHeight.Value
+        safeHeight = obj.SafeHeight.Value
+        vertFeed = float(obj.ToolVertFeed)
+        horizFeed = float(obj.ToolHorizFeed)
+        tanHelix = math.tan(math.radians(max(float(obj.HelixAngle), 1)))
 
         self.depthParameters = PathUtils.depth_params(
-          clearance_height=obj.ClearanceHeight.Value,
-          safe_height=obj.SafeHeight.Value,
+          clearance_height=clearanceHeight,
+          safe_height=safeHeight,
           start_depth=obj.StartDepth.Value,
           step_down=stepDown,
           z_finish_step=finish_step,
           final_depth=obj.FinalDepth.Value,
           user_depths=None)
 
-        passStartDepth = obj.StartDepth.Value
-        for passEndDepth in self.depthParameters.data:
-            for region in adaptiveResults:
-    
-                center = region["HelixCenterPoint"]
-                start = region["StartPoint"]
-                helixRadius = math.sqrt( math.pow(center[0]-start[0], 2) + math.pow(center[1]-start[1], 2) )
-    
-                #helix ramp
-                if helixRadius>0.0001:
-                    Console.PrintMessage("Helix radius = %f\n"%helixRadius)
-                    self.commandList.append(Path.Command("(Helix to pass depth: %f)"%passEndDepth))
-
-                    startAngle = math.atan2( start[1] - center[1], start[0] - center[0] )
-                    helixStart = [center[0] + helixRadius * math.cos(startAngle), center[1] + helixRadius * math.sin(startAngle)]
-                    self.commandList.append(Path.Command("G0", {"X": helixStart[0], "Y": helixStart[1], "Z": obj.ClearanceHeight.Value}))
-                    self.commandList.append(Path.Command("G0", {"X": helixStart[0], "Y": helixStart[1], "Z": obj.SafeHeight.Value}))
-                    self.commandList.append(Path.Command("G1", {"X": helixStart[0], "Y": helixStart[1], "Z": passStartDepth, "F": obj.ToolVertFeed}))
-    
-                    # calculate depth per helix revolution
-                    circumference = 2*math.pi * helixRadius
-                    helixAngleRadians = math.pi * float(obj.HelixAngle)/180.0
-                    depthPerRevolution = circumference * math.tan(helixAngleRadians)
-                    passDepth = (passStartDepth - passEndDepth)
-                    maxRadians =  passDepth / depthPerRevolution *  2 * math.pi
-
-                    currentRadians = 0
-                    while currentRadians < maxRadians:
-                        x = center[0] + helixRadius * math.cos(currentRadians + startAngle)
-                        y = center[1] + helixRadius * math.sin(currentRadians + startAngle)
-                        z = passStartDepth - currentRadians / maxRadians * passDepth
-                        self.commandList.append(Path.Command("G1", { "X":x, "Y":y, "Z":z, "F": obj.ToolVertFeed}))
-                        currentRadians += math.pi/18
-
-                    # one more circle at target depth to make sure center is cleared
-                    maxRadians += 2*math.pi
-                    while currentRadians < maxRadians:
-                        x = center[0] + helixRadius * math.cos(currentRadians + startAngle)
-                        y = center[1] + helixRadius * math.sin(currentRadians + startAngle)
-                        z = passEndDepth
-                        self.commandList.append(Path.Command("G1", { "X":x, "Y":y, "Z":z, "F": obj.ToolHorizFeed}))
-                        currentRadians += math.pi/18
-
-                else: # no helix entry
-                    self.commandList.append(Path.Command("(Straight to pass depth: %f)"%passEndDepth))
-                    self.commandList.append(Path.Command("G0", {"X":start[0], "Y": start[1], "Z": obj.ClearanceHeight.Value}))
-                    self.commandList.append(Path.Command("G1", {"X":start[0], "Y": start[1], "Z": passEndDepth,"F": obj.ToolVertFeed}))
-    
-                lastZ = passEndDepth
-                z = obj.ClearanceHeight.Value
-
-                self.commandList.append(Path.Command("(Adaptive toolpath at depth: %f)"%passEndDepth))
-                for path in region["AdaptivePaths"]:
-                    motionType = path[0]  	#[0] contains motion type
-                    for point in path[1]: 	#[1] contains list of points
-                        x=point[0]
-                        y=point[1]
-                        if motionType == area.AdaptiveMotionType.Cutting:
-                            z=passEndDepth
-                            if z!=lastZ: self.commandList.append(Path.Command("G1", { "Z":z,"F": obj.ToolVertFeed}))
-                            self.commandList.append(Path.Command("G1", { "X":x, "Y":y, "F": obj.ToolHorizFeed})) 
-                        elif motionType == area.AdaptiveMotionType.LinkClear:
-                            z=passEndDepth+stepUp
-                            if z!=lastZ: self.commandList.append(Path.Command("G0", { "Z":z}))
-                            self.commandList.append(Path.Command("G0", { "X":x, "Y":y}))
-                        elif motionType == area.AdaptiveMotionType.LinkNotClear:
-                            z=obj.ClearanceHeight.Value
-                            if z!=lastZ: self.commandList.append(Path.Command("G0", { "Z":z}))
-                            self.commandList.append(Path.Command("G0", { "X":x, "Y":y}))
-                            Console.PrintMessage("X= %f, Y= %f" % x,y)
-                        lastZ = z
-                #return to safe height in this Z pass
-                z=obj.ClearanceHeight.Value
-                if z!=lastZ: self.commandList.append(Path.Command("G0", { "Z":z}))
-                lastZ = z
-            passStartDepth=passEndDepth
-            #return to safe height in this Z pass
-            z=obj.ClearanceHeight.Value
-            if z!=lastZ: self.commandList.append(Path.Command("G0", { "Z":z}))
-            lastZ = z
-        z=obj.ClearanceHeight.Value
-        if z!=lastZ: self.commandList.append(Path.Command("G0", { "Z":z}))
-        lastZ = z
+        # The helix of a region only depends on its pass depth through the number of turns, compute its points
+        # once for the deepest pass and use the leading points for each pass
+        depths = np.array([obj.StartDepth.Value] + list(self.depthParameters.data), dtype=np.float64)
+        passDepths = np.stack((depths[:-1], depths[1:]), axis=1)
+        maxPassDepth = float(np.max(-np.diff(depths), initial=0))
+        helixes = [regionHelix(region, tanHelix, maxPassDepth) for region in adaptiveResults]
+        regionPoints = [flattenPaths(region) for region in adaptiveResults]
+
+        for passStartDepth, passEndDepth in passDepths.tolist():
+            for region, helix, points in zip(adaptiveResults, helixes, regionPoints):
+                self.gcodeLines.extend(regionGCode(region, helix, points, passStartDepth, passEndDepth,
+                    stepUp, clearanceHeight, safeHeight, vertFeed, horizFeed))
     
     def placeToolpath(self, obj):
       """
@@ -318,46 +519,39 @@ class PathAdaptive():
       GCode command to give the toolpath its intended placement.
       """
 
-      # Complete GCode with coordinates for all axis to make placement more straightforward
-      commands = obj.Path.Commands
-      for i, command in enumerate(commands):
-        if (command.Name == 'G0') or (command.Name == 'G1'):
-          if 'X' in command.Parameters:
-            previousX = command.Parameters['X']
-          else:
-            commands[i].X = previousX	# modify in place
-
-          if 'Y' in command.Parameters:
-            previousY = command.Parameters['Y']
-          else:
-            commands[i].Y = previousY	# modify in place
-
-          if 'Z' in command.Parameters:
-            previousZ = command.Parameters['Z']
-          else:
-            commands[i].Z = previousZ  	# modify in place
-      obj.Path.Commands = commands
-
       # Placement used to transform command endpoints
       placement = FreeCAD.Placement()
       placement.Base = obj.Position
-      rotation1 = FreeCAD.Rotation(obj.TemporaryNormal, obj.Normal)
-      rotation2 = FreeCAD.Rotation(obj.TemporaryDirection, obj.Direction)
+      rotation1 = vectorRotation(obj.TemporaryNormal, obj.Normal)
+      rotation2 = vectorRotation(obj.TemporaryDirection, obj.Direction)
       placement.Rotation = rotation1.multiply(rotation2)
 
-      # Create vectors for command endpoints, and move these according to above placement
-      commands = obj.Path.Commands
-      for i, command in enumerate(commands):
-        if (command.Name == 'G0') or (command.Name == 'G1'):
-          x = command.Parameters['X']
-          y = command.Parameters['Y']
-          z = command.Parameters['Z']
-          temporaryVector = FreeCAD.Vector(x,y,z)
-          vector = placement.multVec(temporaryVector)
-          commands[i].X = vector.x
-          commands[i].Y = vector.y
-          commands[i].Z = vector.z
-      obj.Path.Commands = commands
+      if placement.isIdentity():
+        # toolpath is already in place, so it is used as it is
+        toolpathLines = [obj.Path.toGCode().rstrip("\n")]
+      else:
+        # GCode from generateGCode has coordinates for all axis on every move
+        toolpathCommands = obj.Path.Commands
+        moves = [i for i, command in enumerate(toolpathCommands) if (command.Name == 'G0') or (command.Name == 'G1')]
+        moveParameters = [toolpathCommands[i].Parameters for i in moves]
+        points = np.array([(parameters['X'], parameters['Y'], parameters['Z']) for parameters in moveParameters],
+          dtype=np.float64).reshape(-1, 3)
+
+        # Move all command endpoints according to above placement at once
+        matrix = np.array(placement.Matrix.A).reshape(4, 4)
+        placedPoints = points @ matrix[:3, :3].T + matrix[:3, 3]
+
+        # write the transformed toolpath as G-code, which is parsed into a Path at once
+        # instead of setting the coordinates of each command
+        placedMoves = dict(zip(moves, zip(moveParameters, placedPoints.tolist())))
+        toolpathLines = []
+        for i, command in enumerate(toolpathCommands):
+          if i in placedMoves:
+            parameters, (x, y, z) = placedMoves[i]
+            parameters.update(X=x, Y=y, Z=z)
+            toolpathLines.append(command.Name + "".join(" %s%f" % (name, value) for name, value in parameters.items()))
+          else:
+            toolpathLines.append(command.toGCode())
 
       # Calculate angles of rotational axis (AC or BC)
       toolOrientation = obj.Normal
@@ -374,23 +568,18 @@ class PathAdaptive():
 
       # Bring tool to clearance height
       operationStartPoint = obj.Position + obj.ClearanceHeight.Value*obj.Normal.normalize()
-      commands = []
+      clearanceLine = "G0 X%f Y%f Z%f" % (operationStartPoint.x, operationStartPoint.y, obj.ClearanceHeightBetweenOperations.Value)
+      gcodeLines = ["(Start at clearance height)", clearanceLine]
 
-      command = Path.Command("(Start at clearance height)")
-      commands.append(command)
-      command = Path.Command('G0', {'X': operationStartPoint.x, 'Y': operationStartPoint.y , 'Z': obj.ClearanceHeightBetweenOperations.Value})
-      commands.append(command)
+      # add toolpath that was just transformed
+      gcodeLines.extend(toolpathLines)
 
-      # add commands for toolpath that was just transformed
-      commands.extend(obj.Path.Commands)
-      
       # Return tool to clearance height
-      command = Path.Command("(Return to clearance height)")
-      commands.append(command)
-      command = Path.Command('G0', {'X': operationStartPoint.x, 'Y': operationStartPoint.y , 'Z': obj.ClearanceHeightBetweenOperations.Value})
-      commands.append(command)
+      gcodeLines.append("(Return to clearance height)")
+      gcodeLines.append(clearanceLine)
 
-      obj.Path.Commands = commands
+      # obj.Path returns a copy, so the path has to be assigned as a whole
+      obj.Path = Path.Path("\n".join(gcodeLines))
 
 def create(doc, resources):
     '''
@@ -412,6 +601,8 @@ def test(doc=None):
     Create an adaptive operation for testing
     """
 
+    from Truss import Mortise
+
     if not doc:
         doc = FreeCAD.newDocument()
     
@@ -432,17 +623,17 @@ def test(doc=None):
 
     mortisePlacement = FreeCAD.Placement()
     mortisePlacement.Base = position
-    rotation1 = FreeCAD.Rotation(temporaryNormal, normal)
-    rotation2 = FreeCAD.Rotation(temporaryDirection, direction)
+    rotation1 = vectorRotation(temporaryNormal, normal)
+    rotation2 = vectorRotation(temporaryDirection, direction)
     mortisePlacement.Rotation = rotation1.multiply(rotation2)
 
     # STOCK FACE
 
     height = 100
     width = 100
-    centerPoint = FreeCAD.Vector(-height/2, -width/2, 0)
-    stockFace = Part.makePlane(height, width, centerPoint)
-    stockShape = stockFace.extrude(-mortiseDepth*temporaryNormal)
+    stockFace = Mortise.makeStockFace(height, width).copy()
+    # the stock face lies in the XY plane, so extruding it along the temporary normal gives a box
+    stockShape = Part.makeBox(height, width, mortiseDepth, FreeCAD.Vector(-height/2, -width/2, -mortiseDepth))
     stockObject = doc.addObject('Part::Feature', 'StockFace')
     stockObject.Shape = stockFace
     stockObject.Placement = mortisePlacement
@@ -451,24 +642,7 @@ def test(doc=None):
  
     # MORTISE FACE
 
-    length = mortiseLength
-    width = mortiseWidth
-    ## Points in each quadrant
-    point0 = FreeCAD.Vector(+width/2, +length/2-width/2, 0)
-    point1 = FreeCAD.Vector(-width/2, +length/2-width/2, 0)
-    point2 = FreeCAD.Vector(-width/2, -length/2+width/2, 0)
-    point3 = FreeCAD.Vector(+width/2, -length/2+width/2, 0)
-    ## Side lines
-    line03 = Part.makeLine(point3,point0)
-    line21 = Part.makeLine(point1,point2)
-    ## Arcs
-    point10 = FreeCAD.Vector(0, +length/2, 0)
-    point32 = FreeCAD.Vector(0, -length/2, 0)
-    arc10 = Part.Edge(Part.Arc(point1,point10,point0))
-    arc32 = Part.Edge(Part.Arc(point3,point32,point2))
-    ## Face and Shape
-    mortiseWire = Part.Wire([line03,arc32,line21,arc10])
-    mortiseFace = Part.Face(mortiseWire)
+    mortiseFace = Mortise.makeMortiseFace(mortiseLength, mortiseWidth).copy()
     mortiseShape = mortiseFace.extrude(-mortiseDepth*temporaryNormal)
     mortiseObject = doc.addObject('Part::Feature', 'MortiseFace')
     mortiseObject.Shape = mortiseFace
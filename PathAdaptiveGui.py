@@ -182,6 +182,8 @@ class TaskPanelOpPage(PathOpGui.TaskPanelPage):
         self.form.StopButton.setChecked(obj.Stopped)
         obj.setEditorMode('AdaptiveInputState', 2) #hide this property
         obj.setEditorMode('AdaptiveOutputState', 2) #hide this property
+        obj.setEditorMode('AdaptiveOutputFile', 2) #hide this property
+        obj.setEditorMode('AdaptiveInputHash', 2) #hide this property
         obj.setEditorMode('StopProcessing', 2)  # hide this property
         obj.setEditorMode('Stopped', 2)  # hide this property
 
@@ -214,6 +216,8 @@ class TaskPanelOpPage(PathOpGui.TaskPanelPage):
         self.updateToolController(obj, self.form.ToolController)
         obj.setEditorMode('AdaptiveInputState', 2) #hide this property
         obj.setEditorMode('AdaptiveOutputState', 2) #hide this property
+        obj.setEditorMode('AdaptiveOutputFile', 2) #hide this property
+        obj.setEditorMode('AdaptiveInputHash', 2) #hide this property
         obj.setEditorMode('StopProcessing', 2)  # hide this property
         obj.setEditorMode('Stopped', 2)  # hide this property
 
@@ -25,6 +25,7 @@
 import ArchPanel
 import Draft
 import FreeCAD
+import functools
 import Part
 import Path
 import PathScripts.PathIconViewProvider as PathIconViewProvider
@@ -51,13 +52,28 @@ else:
 def translate(context, text, disambig=None):
     return QtCore.QCoreApplication.translate(context, text, disambig)
 
+@functools.lru_cache(maxsize=16)
+def loadPostProcessor(name):
+    '''Return the loaded post processor script, which is only loaded once for each name.
+    Call loadPostProcessor.cache_clear() to load changed scripts again.'''
+    return PostProcessor.load(name)
+
+def setPathCenter(obj, center):
+    '''Set the center of rotation of the path of obj, obj.Path returns a copy so the path is assigned as a whole.'''
+    path = obj.Path
+    path.Center = center
+    obj.Path = path
+
+def isSharedToolController(obj, tc):
+    '''Return True if another job than obj also uses the tool controller tc.'''
+    return any(isinstance(getattr(user, 'Proxy', None), ObjectJob) and user.Name != obj.Name for user in tc.InList)
+
 def isArchPanelSheet(obj):
     return hasattr(obj, 'Proxy') and isinstance(obj.Proxy, ArchPanel.PanelSheet)
 
 def isResourceClone(obj, propLink, resourceName):
-    if hasattr(propLink, 'PathResource') and (resourceName is None or resourceName == propLink.PathResource):
-        return True
-    return False
+    resource = getattr(propLink, 'PathResource', None)
+    return resource is not None and (resourceName is None or resourceName == resource)
 
 def createResourceClone(obj, orig, name, icon):
     if isArchPanelSheet(orig):
@@ -71,7 +87,7 @@ def createResourceClone(obj, orig, name, icon):
     if clone.ViewObject:
         PathIconViewProvider.Attach(clone.ViewObject, icon)
         clone.ViewObject.Visibility = False
-    obj.Document.recompute() # necessary to create the clone shape
+    clone.recompute() # necessary to create the clone shape, the rest of the document doesn't depend on it yet
     return clone
 
 def createModelResourceClone(obj, orig):
@@ -121,40 +137,55 @@ class ObjectJob:
         obj.Stock = stockObject
 
     def addOperation(self, operation, before = None):
+        self.addOperations([operation], before)
+
+    def addOperations(self, operations, before = None):
+        '''Add the operations that aren't in the job yet, assigning the group of operations only once.'''
         group = self.obj.Operations.Group
-        if operation not in group:
+        names = set(op.Name for op in group)
+        added = []
+        for operation in operations:
+            if operation.Name not in names:
+                names.add(operation.Name)
+                added.append(operation)
+        if added:
             if before:
                 try:
-                    group.insert(group.index(before), operation)
+                    index = group.index(before)
+                    group[index:index] = added
                 except Exception as e:
                     PathLog.error(e)
-                    group.append(operation)
+                    group.extend(added)
             else:
-                group.append(operation)
+                group.extend(added)
             self.obj.Operations.Group = group
-            operation.Path.Center = self.obj.Operations.Path.Center
+            center = self.obj.Operations.Path.Center
+            for operation in added:
+                setPathCenter(operation, center)
 
     def addToolController(self, tc):
         group = self.obj.ToolController
-        PathLog.debug("addToolController(%s): %s" % (tc.Label, [t.Label for t in group]))
-        if tc.Name not in [str(t.Name) for t in group]:
+        if PathLog.getLevel(PathLog.thisModule()) == PathLog.Level.DEBUG:
+            PathLog.debug("addToolController(%s): %s" % (tc.Label, [t.Label for t in group]))
+        if tc.Name not in set(t.Name for t in group):
             group.append(tc)
             self.obj.ToolController = group
 
     def allOperations(self):
+        '''Return all operations, each one before its base and sub operations.'''
         ops = []
-        def collectBaseOps(op):
-            if hasattr(op, 'TypeId'):
-                if op.TypeId == 'Path::FeaturePython':
-                    ops.append(op)
-                    if hasattr(op, 'Base'):
-                        collectBaseOps(op.Base)
-                if op.TypeId == 'Path::FeatureCompoundPython':
-                    ops.append(op)
-                    for sub in op.Group:
-                        collectBaseOps(sub)
-        for op in self.obj.Operations.Group:
-            collectBaseOps(op)
+        # children are pushed in reverse so they are popped in their original order
+        stack = list(reversed(self.obj.Operations.Group))
+        while stack:
+            op = stack.pop()
+            typeId = getattr(op, 'TypeId', None)
+            if typeId == 'Path::FeaturePython':
+                ops.append(op)
+                if hasattr(op, 'Base'):
+                    stack.append(op.Base)
+            elif typeId == 'Path::FeatureCompoundPython':
+                ops.append(op)
+                stack.extend(reversed(op.Group))
         return ops
 
     def modelBoundBox(self, obj):
@@ -162,7 +193,7 @@ class ObjectJob:
 
     def baseObject(self, obj, base):
         '''Return the base object, not its clone.'''
-        if isResourceClone(obj, base, 'Model') or isResourceClone(obj, base, 'Base'):
+        if getattr(base, 'PathResource', None) in ('Model', 'Base'):
             return base.Objects[0]
         return base
 
@@ -181,10 +212,14 @@ class ObjectJob:
 
     def setCenterOfRotation(self, center):
         if center != self.obj.Path.Center:
-            self.obj.Path.Center = center
-            self.obj.Operations.Path.Center = center
-            for op in self.allOperations():
-                op.Path.Center = center
+            doc = self.obj.Document
+            recomputesFrozen = doc.RecomputesFrozen
+            doc.RecomputesFrozen = True
+            try:
+                for target in [self.obj, self.obj.Operations] + self.allOperations():
+                    setPathCenter(target, center)
+            finally:
+                doc.RecomputesFrozen = recomputesFrozen
 
     def execute(self, obj):
         obj.Path = obj.Operations.Path
@@ -195,9 +230,15 @@ class ObjectJob:
         obj.setEditorMode('Operations', 2) # hide
         obj.setEditorMode('Placement', 2)
 
+    def __getstate__(self):
+        return None
+
+    def __setstate__(self, state):
+        return None
+
     def onChanged(self, obj, prop):
         if prop == "PostProcessor" and obj.PostProcessor:
-            processor = PostProcessor.load(obj.PostProcessor)
+            processor = loadPostProcessor(obj.PostProcessor)
             self.tooltip = processor.tooltip
             self.tooltipArgs = processor.tooltipArgs
 
@@ -213,38 +254,44 @@ class ObjectJob:
         PathLog.track(obj.Label, arg2)
         doc = obj.Document
 
-        # the first to tear down are the ops, they depend on other resources
-        PathLog.debug('taking down ops: %s' % [o.Name for o in self.allOperations()])
-        while obj.Operations.Group:
-            op = obj.Operations.Group[0]
-            if not op.ViewObject or not hasattr(op.ViewObject.Proxy, 'onDelete') or op.ViewObject.Proxy.onDelete(op.ViewObject, ()):
-                PathUtil.clearExpressionEngine(op)
-                doc.removeObject(op.Name)
-        obj.Operations.Group = []
-        doc.removeObject(obj.Operations.Name)
-        obj.Operations = None
-
-        # stock could depend on Model, so delete it first
-        if obj.Stock:
-            PathLog.debug('taking down stock')
-            PathUtil.clearExpressionEngine(obj.Stock)
-            doc.removeObject(obj.Stock.Name)
+        # removing each object would recompute the objects depending on it, which are removed next anyway
+        recomputesFrozen = doc.RecomputesFrozen
+        doc.RecomputesFrozen = True
+        try:
+            # collect everything in the order it is torn down, each resource only depends on the ones after it:
+            # the ops depend on all other resources, stock could depend on Model, base and tool controllers
+            # don't depend on anything inside job
+            ops = obj.Operations.Group
+            refused = [op for op in ops if op.ViewObject and hasattr(op.ViewObject.Proxy, 'onDelete')
+                and not op.ViewObject.Proxy.onDelete(op.ViewObject, ())]
+            if refused:
+                # the job is kept as a whole, the refused ops would be left without their job otherwise
+                PathLog.warning("Job %s is not deleted, its operations %s can't be deleted" % (obj.Label, [op.Label for op in refused]))
+                return False
+
+            stock = [obj.Stock] if obj.Stock else []
+            bases = [base for base in obj.Model.Group if isResourceClone(obj, base, None)]
+            # tool controllers can be shared with other jobs, those are left for the other jobs
+            toolControllers = [tc for tc in obj.ToolController if not isSharedToolController(obj, tc)]
+
+            resources = ops + stock + bases + toolControllers
+            for resource in resources:
+                PathUtil.clearExpressionEngine(resource)
+            names = [op.Name for op in ops] + [obj.Operations.Name] + [resource.Name for resource in stock + bases] + \
+                [obj.Model.Name] + [tc.Name for tc in toolControllers]
+            PathLog.debug('taking down: %s' % names)
+
+            obj.Operations.Group = []
+            obj.Model.Group = []
+            obj.Operations = None
             obj.Stock = None
+            obj.Model = None
+            obj.ToolController = []
 
-        # base doesn't depend on anything inside job
-        for base in obj.Model.Group:
-            PathLog.debug("taking down base %s" % base.Label)
-            self.removeBase(obj, base, False)
-        obj.Model.Group = []
-        doc.removeObject(obj.Model.Name)
-        obj.Model = None
-
-        # Tool controllers don't depend on anything
-        PathLog.debug('taking down tool controller')
-        for tc in obj.ToolController:
-            PathUtil.clearExpressionEngine(tc)
-            doc.removeObject(tc.Name)
-        obj.ToolController = []
+            for name in names:
+                doc.removeObject(name)
+        finally:
+            doc.RecomputesFrozen = recomputesFrozen
         return True
 
 def test():
@@ -252,6 +299,8 @@ def test():
     Create a job for testing
     """
 
+    from Truss import Mortise
+
     document = FreeCAD.newDocument()
 
     type = 'mortise'
@@ -278,30 +327,13 @@ def test():
 
     height = 100
     width = 100
-    centerPoint = FreeCAD.Vector(-height/2, -width/2, 0)
-    stockFace = Part.makePlane(height, width, centerPoint)
-    stockShape = stockFace.extrude(-mortiseDepth*temporaryNormal)
+    stockFace = Mortise.makeStockFace(height, width).copy()
+    # the stock face lies in the XY plane, so extruding it along the temporary normal gives a box
+    stockShape = Part.makeBox(height, width, mortiseDepth, FreeCAD.Vector(-height/2, -width/2, -mortiseDepth))
 
     # MORTISE FACE
 
-    length = mortiseLength
-    width = mortiseWidth
-    ## Points in each quadrant
-    point0 = FreeCAD.Vector(+width/2, +length/2-width/2, 0)
-    point1 = FreeCAD.Vector(-width/2, +length/2-width/2, 0)
-    point2 = FreeCAD.Vector(-width/2, -length/2+width/2, 0)
-    point3 = FreeCAD.Vector(+width/2, -length/2+width/2, 0)
-    ## Side lines
-    line03 = Part.makeLine(point3,point0)
-    line21 = Part.makeLine(point1,point2)
-    ## Arcs
-    point10 = FreeCAD.Vector(0, +length/2, 0)
-    point32 = FreeCAD.Vector(0, -length/2, 0)
-    arc10 = Part.Edge(Part.Arc(point1,point10,point0))
-    arc32 = Part.Edge(Part.Arc(point3,point32,point2))
-    ## Face and Shape
-    mortiseWire = Part.Wire([line03,arc32,line21,arc10])
-    mortiseFace = Part.Face(mortiseWire)
+    mortiseFace = Mortise.makeMortiseFace(mortiseLength, mortiseWidth).copy()
     mortiseShape = mortiseFace.extrude(-mortiseDepth*temporaryNormal)
     mortiseObject = document.addObject('Part::Feature', 'MortiseFace')
     mortiseObject.Shape = mortiseFace
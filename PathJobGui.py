@@ -195,8 +195,7 @@ class ViewProvider:
 
     def onDelete(self, vobj, arg2=None):
         PathLog.track(vobj.Object.Label, arg2)
-        self.obj.Proxy.onDelete(self.obj, arg2)
-        return True
+        return self.obj.Proxy.onDelete(self.obj, arg2)
 
     def updateData(self, obj, prop):
         PathLog.track(obj.Label, prop)
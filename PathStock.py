@@ -24,6 +24,7 @@
 
 import FreeCAD
 import Part
+import functools
 import PathScripts.PathIconViewProvider as PathIconViewProvider
 import PathScripts.PathLog as PathLog
 import math
@@ -41,6 +42,24 @@ else:
 def translate(context, text, disambig=None):
     return QtCore.QCoreApplication.translate(context, text, disambig)
 
+@functools.lru_cache(maxsize=64)
+def makeBoxShape(length, width, height, origin=(0, 0, 0)):
+    '''Return a box shape, boxes are cached by their size and origin so stocks of the same size share them.
+    Callers should copy the result before modifying it.'''
+    return Part.makeBox(length, width, height, FreeCAD.Vector(*origin))
+
+@functools.lru_cache(maxsize=64)
+def makeCylinderShape(radius, height):
+    '''Return a cylinder shape, cached by its size like the boxes of makeBoxShape.'''
+    return Part.makeCylinder(radius, height)
+
+def setupStockView(obj):
+    '''Attach the stock view provider and display the stock as a transparent wireframe, if it hasn't been done yet.'''
+    if FreeCAD.GuiUp and obj.ViewObject and not isinstance(obj.ViewObject.Proxy, PathIconViewProvider.ViewProvider):
+        PathIconViewProvider.ViewProvider(obj.ViewObject, 'Stock')
+        obj.ViewObject.Transparency = 90
+        obj.ViewObject.DisplayMode = 'Wireframe'
+
 class StockFromBase():
 
     def __init__(self, obj, baseObject, neg={'x':1, 'y':1, 'z':1}, pos={'x':1, 'y':1, 'z':1}):
@@ -51,6 +70,8 @@ class StockFromBase():
 
         obj.Proxy = self
         self.obj = obj
+        # the shape is built once after all dimensions are set instead of for each of them
+        self.suspendExecute = True
 
         obj.addProperty("App::PropertyString", 'StockType', 'Stock', QtCore.QT_TRANSLATE_NOOP("PathStock", "Internal representation of stock type"))
         obj.addProperty("App::PropertyLink", "BaseObject", "Base", QtCore.QT_TRANSLATE_NOOP("PathStock", "The shape this stock is derived from"))
@@ -74,6 +95,9 @@ class StockFromBase():
         obj.ExtYpos = pos['y']
         obj.ExtZpos = pos['z']
 
+        self.suspendExecute = False
+        self.execute(obj)
+
     def execute(self, obj):
         bb = obj.BaseObject.Shape.BoundBox if obj.BaseObject else None
 
@@ -82,22 +106,26 @@ class StockFromBase():
         # Sometimes, when the Base changes it's temporarily not assigned when
         # Stock.execute is triggered - it'll be set correctly the next time around.
         if bb:
-            self.origin = FreeCAD.Vector(bb.XMin-obj.ExtXneg.Value, bb.YMin-obj.ExtYneg.Value, bb.ZMin-obj.ExtZneg.Value)
+            xMin, yMin, zMin, xMax, yMax, zMax = bb.XMin, bb.YMin, bb.ZMin, bb.XMax, bb.YMax, bb.ZMax
+            extXneg, extYneg, extZneg = obj.ExtXneg.Value, obj.ExtYneg.Value, obj.ExtZneg.Value
+            extXpos, extYpos, extZpos = obj.ExtXpos.Value, obj.ExtYpos.Value, obj.ExtZpos.Value
 
-            self.length = bb.XLength + obj.ExtXneg.Value + obj.ExtXpos.Value
-            self.width  = bb.YLength + obj.ExtYneg.Value + obj.ExtYpos.Value
-            self.height = bb.ZLength + obj.ExtZneg.Value + obj.ExtZpos.Value
+            # the stock is left as it is when neither the bound box nor the allowances changed
+            boxKey = (xMin, yMin, zMin, xMax, yMax, zMax, extXneg, extYneg, extZneg, extXpos, extYpos, extZpos)
+            if boxKey != getattr(self, 'boxKey', None):
+                self.origin = FreeCAD.Vector(xMin-extXneg, yMin-extYneg, zMin-extZneg)
 
-            shape = Part.makeBox(self.length, self.width, self.height, self.origin)
-            obj.Shape = shape
+                self.length = xMax - xMin + extXneg + extXpos
+                self.width  = yMax - yMin + extYneg + extYpos
+                self.height = zMax - zMin + extZneg + extZpos
 
-        if FreeCAD.GuiUp and obj.ViewObject:
-            PathIconViewProvider.ViewProvider(obj.ViewObject, 'Stock')
-            obj.ViewObject.Transparency = 90
-            obj.ViewObject.DisplayMode = 'Wireframe'
+                obj.Shape = makeBoxShape(self.length, self.width, self.height, tuple(self.origin)).copy()
+                self.boxKey = boxKey
+
+        setupStockView(obj)
 
     def onChanged(self, obj, prop):
-        if prop in ['ExtXneg', 'ExtXpos', 'ExtYneg', 'ExtYpos', 'ExtZneg', 'ExtZpos'] and not 'Restore' in obj.State:
+        if prop in ['ExtXneg', 'ExtXpos', 'ExtYneg', 'ExtYpos', 'ExtZneg', 'ExtZpos'] and not 'Restore' in obj.State and not getattr(self, 'suspendExecute', False):
             self.execute(obj)
 
     def onDocumentRestored(self, obj):
@@ -121,6 +149,7 @@ class StockCreateBox():
 
         obj.Proxy = self
         self.obj = obj
+        self.suspendExecute = True
 
         obj.addProperty('App::PropertyString', 'StockType', 'Stock', QtCore.QT_TRANSLATE_NOOP("PathStock", "Internal representation of stock type"))
         obj.StockType = 'CreateBox'
@@ -136,6 +165,9 @@ class StockCreateBox():
         if placement:
             obj.Placement = placement
 
+        self.suspendExecute = False
+        self.execute(obj)
+
     def execute(self, obj):
         if obj.Length < self.MinExtent:
             obj.Length = self.MinExtent
@@ -144,17 +176,14 @@ class StockCreateBox():
         if obj.Height < self.MinExtent:
             obj.Height = self.MinExtent
 
-        shape = Part.makeBox(obj.Length, obj.Width, obj.Height)
+        shape = makeBoxShape(obj.Length.Value, obj.Width.Value, obj.Height.Value).copy()
         shape.Placement = obj.Placement
         obj.Shape = shape
 
-        if FreeCAD.GuiUp and obj.ViewObject:
-            PathIconViewProvider.ViewProvider(obj.ViewObject, 'Stock')
-            obj.ViewObject.Transparency = 90
-            obj.ViewObject.DisplayMode = 'Wireframe'
+        setupStockView(obj)
 
     def onChanged(self, obj, prop):
-        if prop in ['Length', 'Width', 'Height'] and not 'Restore' in obj.State:
+        if prop in ['Length', 'Width', 'Height'] and not 'Restore' in obj.State and not getattr(self, 'suspendExecute', False):
             self.execute(obj)
 
     def onDocumentRestored(self, obj):
@@ -178,6 +207,7 @@ class StockCreateCylinder():
 
         obj.Proxy = self
         self.obj = obj
+        self.suspendExecute = True
 
         obj.addProperty('App::PropertyString', 'StockType', 'Stock', QtCore.QT_TRANSLATE_NOOP("PathStock", "Internal representation of stock type"))
         obj.StockType = 'CreateCylinder'
@@ -191,23 +221,23 @@ class StockCreateCylinder():
         if placement:
             obj.Placement = placement
 
+        self.suspendExecute = False
+        self.execute(obj)
+
     def execute(self, obj):
         if obj.Radius < self.MinExtent:
             obj.Radius = self.MinExtent
         if obj.Height < self.MinExtent:
             obj.Height = self.MinExtent
 
-        shape = Part.makeCylinder(obj.Radius, obj.Height)
+        shape = makeCylinderShape(obj.Radius.Value, obj.Height.Value).copy()
         shape.Placement = obj.Placement
         obj.Shape = shape
 
-        if FreeCAD.GuiUp and obj.ViewObject:
-            PathIconViewProvider.ViewProvider(obj.ViewObject, 'Stock')
-            obj.ViewObject.Transparency = 90
-            obj.ViewObject.DisplayMode = 'Wireframe'
+        setupStockView(obj)
 
     def onChanged(self, obj, prop):
-        if prop in ['Radius', 'Height'] and not 'Restore' in obj.State:
+        if prop in ['Radius', 'Height'] and not 'Restore' in obj.State and not getattr(self, 'suspendExecute', False):
             self.execute(obj)
 
     def onDocumentRestored(self, obj):